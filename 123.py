@@ -1,5 +1,47 @@
 # crypto_advanced_bot.py (обновленная версия)
 
+import bisect
+import re
+
+# Пороги цены (< 0.001, < 1, остальные) и соответствующие им форматы
+_PRICE_BKTS = (0.001, 1.0)
+_PRICE_FMTS = ("${:.8f}", "${:.6f}", "${:.2f}")
+
+# Минимальный возраст кеша (сек.), после которого принудительное обновление перезапускает анализ
+_FORCE_UPDATE_MIN_AGE = 60
+
+# Текст, похожий на символ монеты: 2-10 латинских букв, цифр и пробелов (не только пробелы)
+_SYMBOL_RE = re.compile(r'(?! *$)[A-Za-z0-9 ]{2,10}')
+
+# Кнопки меню и имена методов бота, которые их обрабатывают (ищутся при вызове)
+_MENU_COMMANDS = {
+    '🏆 ТОП 10': 'show_top_predictions',
+    '🔄 ОБНОВИТЬ': '_handle_update_button',
+    '📊 СТАТИСТИКА': 'show_statistics',
+    '🔍 АНАЛИЗ МОНЕТЫ': 'ask_for_coin_symbol'
+}
+
+# Эмодзи для первых трех мест топа
+_MEDALS = ("🥇", "🥈", "🥉")
+
+# Тип монеты по ключу _type_key: 0 - новая, 1 - восходящая (volume screener), 2 - топ
+_TYPE_EMOJI = ("🆕", "📈", "🏆")
+_TYPE_LABEL = ("🆕 Новая монета", "📈 Восходящая звезда", "🏆 Топ монета")
+
+# Шаблон заголовка детального анализа монеты
+_DETAIL_TMPL = (
+    "\n🔍 <b>ДЕТАЛЬНЫЙ АНАЛИЗ - {symbol}</b>\n\n"
+    "⭐ <b>Общий счет:</b> {score}/100\n"
+    "{bonus_line}\n"
+    "💰 <b>Цена:</b> {price}\n"
+    "📊 <b>Изменение 24ч:</b> {price_change_24h:.1f}%\n"
+    "🚀 <b>Изменение 7д:</b> {price_change_7d:.1f}%\n"
+    "🏦 <b>Капитализация:</b> ${market_cap:,.0f}\n"
+    "💧 <b>Объем/Капитализация:</b> {volume_ratio:.2%}\n"
+    "🎯 <b>Тип:</b> {type_label}\n\n"
+    "<b>ПОДРОБНЫЙ АНАЛИЗ:</b>\n"
+)
+
 class CryptoAdvancedBot:
     """Продвинутый крипто-бот с автообучением"""
     
@@ -10,72 +52,126 @@ class CryptoAdvancedBot:
         self.db = DatabaseManager()
         self.is_processing = False
         self.cached_predictions = None
+        self._cached_top = []
+        self._cached_by_symbol = {}
+        self._cached_top_message = None
         self.last_successful_update = None
+        self._last_cycle_completed = float('-inf')  # time.monotonic() завершения последнего анализа
         self.last_stats_update = datetime.now() - timedelta(hours=24)
+        self.last_manual_update = float('-inf')  # time.monotonic() последнего ручного обновления
+    
+    @staticmethod
+    def format_price(price: float) -> str:
+        """Форматирует цену с точностью, зависящей от ее порядка"""
+        if price is None:
+            return "N/A"
+        return _PRICE_FMTS[bisect.bisect_right(_PRICE_BKTS, price)].format(price)
+    
+    @staticmethod
+    def _dedup_by_symbol(*coin_lists: List[Dict]) -> List[Dict]:
+        """Объединяет списки монет, оставляя первое вхождение каждого символа"""
+        unique_coins = {}
+        for coins in coin_lists:
+            for coin in coins:
+                unique_coins.setdefault(coin['symbol'].upper(), coin)
+        return list(unique_coins.values())
+    
+    @staticmethod
+    def _coin_type_key(coin: Dict) -> int:
+        """Возвращает индекс типа монеты для _TYPE_EMOJI/_TYPE_LABEL"""
+        type_key = coin.get('_type_key')
+        if type_key is None:
+            if coin.get('is_new'):
+                type_key = 0
+            elif coin.get('discovery_source') == DiscoverySource.VOLUME_SCREENER.value:
+                type_key = 1
+            else:
+                type_key = 2
+        return type_key
+    
+    async def _run_full_analysis(self, analyzer, cycle_ts: datetime = None) -> List[Dict]:
+        """Загружает, анализирует и ранжирует монеты, обновляя кеш предсказаний.
+        
+        cycle_ts - единая метка времени цикла анализа (по умолчанию текущее время).
+        Возвращает топ-10 анализов по score.
+        """
+        if cycle_ts is None:
+            cycle_ts = datetime.now()
+        
+        # Параллельно загружаем топ-монеты и перспективные монеты
+        top_coins_task = asyncio.create_task(analyzer.fetch_top_coins(50))
+        potential_coins_task = asyncio.create_task(analyzer.fetch_potential_coins(150))
+        
+        top_coins, potential_coins = await asyncio.gather(
+            top_coins_task, potential_coins_task
+        )
+        
+        # Объединяем и убираем дубликаты
+        coins_to_analyze = self._dedup_by_symbol(top_coins, potential_coins)
+        logger.info(f"📊 Всего монет для анализа: {len(coins_to_analyze)}")
+        
+        # Анализируем все монеты с ограничением параллелизма
+        analyses = []
+        semaphore = asyncio.Semaphore(10)
+        
+        async def analyze_with_semaphore(coin):
+            async with semaphore:
+                return await analyzer.analyze_coin(coin)
+        
+        analysis_tasks = [analyze_with_semaphore(coin) for coin in coins_to_analyze]
+        results = await asyncio.gather(*analysis_tasks, return_exceptions=True)
+        
+        # Собираем успешные анализы
+        for result in results:
+            if isinstance(result, dict) and result.get('score', 0) >= 40:  # Минимальный порог для топа
+                result['_type_key'] = self._coin_type_key(result)
+                analyses.append(result)
+        
+        # Сортируем по score и сохраняем все анализы для кеша
+        analyses.sort(key=lambda x: x['score'], reverse=True)
+        self.cached_predictions = analyses
+        self._cached_top = analyses[:10]
+        self._cached_by_symbol = {c['symbol'].upper(): c for c in analyses}
+        self._cached_top_message = None
+        self.last_successful_update = cycle_ts
+        self._last_cycle_completed = time.monotonic()
+        
+        return self._cached_top
     
     async def show_top_predictions(self, force_update: bool = False):
-        """Показывает топ-10 перспективных монет из полного анализа"""
+        """Показывает топ-10 перспективных монет из полного анализа.
+        
+        Возвращает True после нового анализа, False при показе из кеша и None при ошибке.
+        """
         logger.info("🏆 Формирование топ-10 перспективных монет...")
         
-        # Если есть кеш и не принудительное обновление - используем кеш
-        if self.cached_predictions and not force_update:
-            message = await self.format_top_predictions(
-                self.cached_predictions[:10], 
+        # Если есть кеш и не принудительное обновление - используем кеш.
+        # Принудительное обновление тоже берем из кеша, если анализ завершился только что
+        if self.cached_predictions and (
+            not force_update
+            or time.monotonic() - self._last_cycle_completed < _FORCE_UPDATE_MIN_AGE
+        ):
+            # Список монет рендерим один раз на цикл анализа, заново - только строку о свежести
+            if self._cached_top_message is None:
+                self._cached_top_message = self._format_top_body(self._cached_top)
+            message = self._cached_top_message + self._format_top_footer(
                 show_cache_info=True,
                 update_time=self.last_successful_update
             )
             await self.send_message(message)
-            return
+            return False
         
         # Запускаем полный анализ
         async with AdvancedAnalyzer(self.db) as analyzer:
             try:
-                # Параллельно загружаем топ-монеты и перспективные монеты
-                top_coins_task = asyncio.create_task(analyzer.fetch_top_coins(50))
-                potential_coins_task = asyncio.create_task(analyzer.fetch_potential_coins(150))
-                
-                top_coins, potential_coins = await asyncio.gather(
-                    top_coins_task, potential_coins_task
-                )
-                
-                # Объединяем и убираем дубликаты
-                all_coins = top_coins + potential_coins
-                unique_coins = {}
-                for coin in all_coins:
-                    symbol = coin['symbol'].upper()
-                    if symbol not in unique_coins:
-                        unique_coins[symbol] = coin
-                
-                coins_to_analyze = list(unique_coins.values())
-                logger.info(f"📊 Всего монет для анализа: {len(coins_to_analyze)}")
-                
-                # Анализируем все монеты с ограничением параллелизма
-                analyses = []
-                semaphore = asyncio.Semaphore(10)
-                
-                async def analyze_with_semaphore(coin):
-                    async with semaphore:
-                        return await analyzer.analyze_coin(coin)
-                
-                analysis_tasks = [analyze_with_semaphore(coin) for coin in coins_to_analyze]
-                results = await asyncio.gather(*analysis_tasks, return_exceptions=True)
-                
-                # Собираем успешные анализы
-                for result in results:
-                    if isinstance(result, dict) and result.get('score', 0) >= 40:  # Минимальный порог для топа
-                        analyses.append(result)
-                
-                # Сортируем по score и берем топ-10
-                analyses.sort(key=lambda x: x['score'], reverse=True)
-                top_10 = analyses[:10]
-                self.cached_predictions = analyses  # Сохраняем все анализы для кеша
-                self.last_successful_update = datetime.now()
+                top_10 = await self._run_full_analysis(analyzer)
                 
                 # Форматируем и отправляем топ-10
                 message = await self.format_top_predictions(top_10, force_update=force_update)
                 await self.send_message(message)
                 
                 logger.info(f"✅ Топ-10 сформирован. Лучшая монета: {top_10[0]['symbol']} - {top_10[0]['score']}%")
+                return True
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка формирования топа: {e}")
@@ -89,42 +185,59 @@ class CryptoAdvancedBot:
         if not predictions:
             return "📊 <b>ТОП 10 ПЕРСПЕКТИВНЫХ МОНЕТ</b>\n\nНа данный момент нет подходящих монет для анализа."
         
-        message = "🏆 <b>ТОП 10 ПЕРСПЕКТИВНЫХ МОНЕТ</b>\n\n"
+        return self._format_top_body(predictions) + self._format_top_footer(
+            show_cache_info, update_time, force_update
+        )
+    
+    def _format_top_body(self, predictions: List[Dict]) -> str:
+        """Форматирует список монет топа без информации об обновлении"""
+        parts = ["🏆 <b>ТОП 10 ПЕРСПЕКТИВНЫХ МОНЕТ</b>\n\n"]
+        # Локальные ссылки для горячего цикла
+        append = parts.append
+        fmt_price = self.format_price
+        type_key = self._coin_type_key
+        type_emojis = _TYPE_EMOJI
+        medals = _MEDALS
         
         for i, coin in enumerate(predictions, 1):
-            emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
+            emoji = medals[i - 1] if i <= 3 else f"{i}."
             
             # Определяем тип монеты для эмодзи
-            type_emoji = "🆕" if coin.get('is_new') else "📈" if coin.get('discovery_source') == DiscoverySource.VOLUME_SCREENER.value else "🏆"
+            type_emoji = type_emojis[type_key(coin)]
             
-            message += f"{emoji} {type_emoji} <b>{coin['symbol']}</b> - Score: {coin['score']}%\n"
-            message += f"   💰 {self.format_price(coin['price'])} | 📈 {coin['price_change_24h']:.1f}% | 🚀 {coin['price_change_7d']:.1f}%\n"
+            append(f"{emoji} {type_emoji} <b>{coin['symbol']}</b> - Score: {coin['score']}%\n")
+            append(f"   💰 {fmt_price(coin['price'])} | 📈 {coin['price_change_24h']:.1f}% | 🚀 {coin['price_change_7d']:.1f}%\n")
             
             # Показываем основной фактор успеха
             if coin['analysis']:
-                main_reason = list(coin['analysis'].values())[0]
+                main_reason = next(iter(coin['analysis'].values()))
                 # Обрезаем длинные описания
                 if len(main_reason) > 50:
                     main_reason = main_reason[:47] + "..."
-                message += f"   🔍 {main_reason}\n"
+                append(f"   🔍 {main_reason}\n")
             
             # Показываем бонус если есть
             if coin.get('bonus_applied', 0) > 0:
-                message += f"   💎 Бонус: +{coin['bonus_applied']}%\n"
+                append(f"   💎 Бонус: +{coin['bonus_applied']}%\n")
             
-            message += "\n"
+            append("\n")
         
-        # Информация об обновлении
+        return "".join(parts)
+    
+    @staticmethod
+    def _format_top_footer(show_cache_info: bool = False,
+                           update_time: datetime = None,
+                           force_update: bool = False) -> str:
+        """Форматирует информацию о свежести данных топа"""
+        footer = ""
         if force_update:
-            message += "⚡ <b>Данные обновлены только что</b>\n"
+            footer = "⚡ <b>Данные обновлены только что</b>\n"
         elif show_cache_info and update_time:
             time_diff = datetime.now() - update_time
             minutes_ago = int(time_diff.total_seconds() / 60)
-            message += f"💾 <i>Данные актуальны на {update_time.strftime('%H:%M:%S')} ({minutes_ago} мин. назад)</i>\n"
-        
-        message += "🔄 <i>Авто-обновление каждые 15 минут</i>"
+            footer = f"💾 <i>Данные актуальны на {update_time.strftime('%H:%M:%S')} ({minutes_ago} мин. назад)</i>\n"
         
-        return message
+        return footer + "🔄 <i>Авто-обновление каждые 15 минут</i>"
     
     async def run_analysis_cycle(self):
         """Запускает улучшенный цикл анализа с формированием топа"""
@@ -132,45 +245,8 @@ class CryptoAdvancedBot:
         
         async with AdvancedAnalyzer(self.db) as analyzer:
             try:
-                # Параллельно загружаем топ-монеты и перспективные монеты
-                top_coins_task = asyncio.create_task(analyzer.fetch_top_coins(50))
-                potential_coins_task = asyncio.create_task(analyzer.fetch_potential_coins(150))
-                
-                top_coins, potential_coins = await asyncio.gather(
-                    top_coins_task, potential_coins_task
-                )
-                
-                # Объединяем и убираем дубликаты
-                all_coins = top_coins + potential_coins
-                unique_coins = {}
-                for coin in all_coins:
-                    symbol = coin['symbol'].upper()
-                    if symbol not in unique_coins:
-                        unique_coins[symbol] = coin
-                
-                coins_to_analyze = list(unique_coins.values())
-                logger.info(f"📊 Всего монет для анализа: {len(coins_to_analyze)}")
-                
-                # Анализируем все монеты с ограничением параллелизма
-                analyses = []
-                semaphore = asyncio.Semaphore(10)
-                
-                async def analyze_with_semaphore(coin):
-                    async with semaphore:
-                        return await analyzer.analyze_coin(coin)
-                
-                analysis_tasks = [analyze_with_semaphore(coin) for coin in coins_to_analyze]
-                results = await asyncio.gather(*analysis_tasks, return_exceptions=True)
-                
-                # Собираем успешные анализы
-                for result in results:
-                    if isinstance(result, dict) and result.get('score', 0) >= 40:
-                        analyses.append(result)
-                
-                # Сортируем по score и сохраняем
-                analyses.sort(key=lambda x: x['score'], reverse=True)
-                self.cached_predictions = analyses
-                self.last_successful_update = datetime.now()
+                cycle_ts = datetime.now()  # Единая метка времени для всего цикла анализа
+                analyses = await self._run_full_analysis(analyzer, cycle_ts)
                 
                 # Автоматически отправляем топ-5 при каждом цикле
                 top_5 = analyses[:5]
@@ -181,9 +257,9 @@ class CryptoAdvancedBot:
                             await asyncio.sleep(2)
                 
                 # Переобучаем ML модель раз в сутки
-                if (datetime.now() - self.last_stats_update).total_seconds() > 24 * 3600:
+                if (cycle_ts - self.last_stats_update).total_seconds() > 24 * 3600:
                     await analyzer.ml_model.retrain_model()
-                    self.last_stats_update = datetime.now()
+                    self.last_stats_update = cycle_ts
                 
                 logger.info(f"✅ Анализ завершен. Топ-1: {analyses[0]['symbol']} - {analyses[0]['score']}%")
                 
@@ -192,30 +268,38 @@ class CryptoAdvancedBot:
 
     async def handle_manual_update(self):
         """Обрабатывает ручное обновление топа"""
-        current_time = time.time()
+        current_time = time.monotonic()
         
         # Проверяем таймер (30 секунд между обновлениями)
-        if hasattr(self, 'last_manual_update'):
-            time_since_last = current_time - self.last_manual_update
-            if time_since_last < 30:
-                seconds_left = 30 - int(time_since_last)
-                return f"⏰ Обновить можно через {seconds_left} сек."
+        time_since_last = current_time - self.last_manual_update
+        if time_since_last < 30:
+            seconds_left = 30 - int(time_since_last)
+            return f"⏰ Обновить можно через {seconds_left} сек."
         
         self.last_manual_update = current_time
-        await self.show_top_predictions(force_update=True)
-        return "✅ Топ-10 обновлен!"
+        refreshed = await self.show_top_predictions(force_update=True)
+        if refreshed:
+            return "✅ Топ-10 обновлен!"
+        if refreshed is False:
+            return "ℹ️ Анализ завершился меньше минуты назад, показан актуальный топ-10"
+        return None  # Об ошибке уже сообщено в show_top_predictions
+
+    async def _handle_update_button(self):
+        """Обрабатывает кнопку ручного обновления и сообщает результат"""
+        result = await self.handle_manual_update()
+        if isinstance(result, str):
+            await self.send_message(result)
 
     async def send_detailed_analysis(self, symbol: str):
         """Показывает детальный анализ конкретной монеты"""
+        # Ищем монету в кеше
+        coin = self._cached_by_symbol.get(symbol.upper())
+        if coin is not None:
+            message = await self.format_detailed_analysis(coin)
+            await self.send_message(message)
+            return
+        
         async with AdvancedAnalyzer(self.db) as analyzer:
-            # Ищем монету в кеше
-            if self.cached_predictions:
-                for coin in self.cached_predictions:
-                    if coin['symbol'].upper() == symbol.upper():
-                        message = await self.format_detailed_analysis(coin)
-                        await self.send_message(message)
-                        return
-            
             # Если не найдено в кеше, делаем отдельный анализ
             logger.info(f"🔍 Детальный анализ монеты: {symbol}")
             # Здесь можно добавить поиск монеты через CoinGecko API
@@ -225,31 +309,28 @@ class CryptoAdvancedBot:
         """Форматирует детальный анализ монеты"""
         symbol = analysis['symbol']
         
-        message = f"""
-🔍 <b>ДЕТАЛЬНЫЙ АНАЛИЗ - {symbol}</b>
-
-⭐ <b>Общий счет:</b> {analysis['score']}/100
-{'💎 <b>Бонус:</b> +' + str(analysis['bonus_applied']) + '%' if analysis.get('bonus_applied', 0) > 0 else ''}
-💰 <b>Цена:</b> {self.format_price(analysis['price'])}
-📊 <b>Изменение 24ч:</b> {analysis['price_change_24h']:.1f}%
-🚀 <b>Изменение 7д:</b> {analysis['price_change_7d']:.1f}%
-🏦 <b>Капитализация:</b> ${analysis['market_cap']:,.0f}
-💧 <b>Объем/Капитализация:</b> {analysis['volume_ratio']:.2%}
-🎯 <b>Тип:</b> {'🆕 Новая монета' if analysis.get('is_new') else '📈 Восходящая звезда' if analysis.get('discovery_source') == DiscoverySource.VOLUME_SCREENER.value else '🏆 Топ монета'}
-
-<b>ПОДРОБНЫЙ АНАЛИЗ:</b>
-"""
+        bonus = analysis.get('bonus_applied', 0)
+        parts = [_DETAIL_TMPL.format(
+            symbol=symbol,
+            score=analysis['score'],
+            bonus_line=f"💎 <b>Бонус:</b> +{bonus}%" if bonus > 0 else "",
+            price=self.format_price(analysis['price']),
+            price_change_24h=analysis['price_change_24h'],
+            price_change_7d=analysis['price_change_7d'],
+            market_cap=analysis['market_cap'],
+            volume_ratio=analysis['volume_ratio'],
+            type_label=_TYPE_LABEL[self._coin_type_key(analysis)]
+        )]
         
-        for metric, desc in analysis['analysis'].items():
-            message += f"• {desc}\n"
+        parts.extend(f"• {desc}\n" for desc in analysis['analysis'].values())
         
         # Добавляем технические индикаторы если есть
         if analysis.get('technical_indicators'):
             indicators = analysis['technical_indicators']
-            message += f"\n<b>ТЕХНИЧЕСКИЕ ИНДИКАТОРЫ:</b>\n"
-            message += f"• RSI: {indicators.get('rsi', 0):.1f}\n"
-            message += f"• MACD: {indicators.get('macd', 0):.4f}\n"
-            message += f"• SMA 20: {self.format_price(indicators.get('sma_20', 0))}\n"
+            parts.append("\n<b>ТЕХНИЧЕСКИЕ ИНДИКАТОРЫ:</b>\n")
+            parts.append(f"• RSI: {indicators.get('rsi', 0):.1f}\n")
+            parts.append(f"• MACD: {indicators.get('macd', 0):.4f}\n")
+            parts.append(f"• SMA 20: {self.format_price(indicators.get('sma_20', 0))}\n")
         
         # Рекомендация на основе score
         if analysis['score'] >= 80:
@@ -261,32 +342,24 @@ class CryptoAdvancedBot:
         else:
             recommendation = "⚠️ <b>СЛАБЫЙ СИГНАЛ</b> - Высокий риск"
         
-        message += f"\n<b>РЕКОМЕНДАЦИЯ:</b>\n{recommendation}"
+        parts.append(f"\n<b>РЕКОМЕНДАЦИЯ:</b>\n{recommendation}")
         
-        return message
+        return "".join(parts)
 
 # Добавляем обработчики команд в основной цикл
 async def handle_message(self, text: str):
     """Обрабатывает текстовые сообщения"""
-    if text == '🏆 ТОП 10':
-        await self.show_top_predictions()
-    elif text == '🔄 ОБНОВИТЬ':
-        result = await self.handle_manual_update()
-        if isinstance(result, str):
-            await self.send_message(result)
-    elif text == '📊 СТАТИСТИКА':
-        await self.show_statistics()
-    elif text == '🔍 АНАЛИЗ МОНЕТЫ':
-        await self.ask_for_coin_symbol()
+    handler_name = _MENU_COMMANDS.get(text)
+    if handler_name is not None:
+        await getattr(self, handler_name)()
     elif text.startswith('/analyze '):
         symbol = text.replace('/analyze ', '').strip().upper()
         await self.send_detailed_analysis(symbol)
+    # Предполагаем что это символ монеты
+    elif _SYMBOL_RE.fullmatch(text):
+        await self.send_detailed_analysis(text)
     else:
-        # Предполагаем что это символ монеты
-        if 2 <= len(text) <= 10 and text.replace(' ', '').isalnum():
-            await self.send_detailed_analysis(text)
-        else:
-            await self.send_message("❌ Неизвестная команда. Используйте меню.")
+        await self.send_message("❌ Неизвестная команда. Используйте меню.")
 
 # Обновляем приветственное сообщение
 WELCOME_MESSAGE = """